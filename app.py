@@ -1,11 +1,48 @@
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore import UNSIGNED
 from botocore.config import Config
 import numpy as np
 import rasterio
+from rasterio.enums import Resampling
 from stl import mesh
 import os
+import glob
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+try:
+    # Optional, compiles the top surface facet loop when available
+    from numba import njit, prange
+except ImportError:
+    njit = None
+try:
+    # Optional, assembles the mesh on a CUDA GPU when requested
+    import cupy
+except ImportError:
+    cupy = None
 
+# Large COG tiles are fetched as parallel ranged GETs of 8 MiB each
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True,
+)
+
+# Number of tile files downloaded in parallel
+DOWNLOAD_WORKERS = 4
+
+# One anonymous S3 client shared by all listing and download calls, so its
+# credentials, endpoint and connection pool are set up only once. The pool
+# covers DOWNLOAD_WORKERS downloads with TRANSFER_CONFIG's concurrency each.
+_SESSION = boto3.session.Session()
+_S3 = _SESSION.client(
+    's3',
+    config=Config(signature_version=UNSIGNED, max_pool_connections=DOWNLOAD_WORKERS * TRANSFER_CONFIG.max_concurrency),
+    region_name='eu-central-1',
+)
 
 def latlon_to_tile(lat, lon, resolution=90):
     """
@@ -18,68 +55,204 @@ def latlon_to_tile(lat, lon, resolution=90):
     lon_deg = abs(int(lon))
     return f"Copernicus_DSM_COG_{resolution}_{lat_prefix}{lat_deg:02d}_00_{lon_prefix}{lon_deg:03d}_00_DEM"
 
-def download_tile_files(lat, lon, resolution=90, download_path='.', area_km=10):
+def _list_cache_file(bucket_name, prefix, cache_dir):
+    digest = hashlib.sha1(f"{bucket_name}/{prefix}".encode()).hexdigest()
+    return os.path.join(cache_dir, f"list_{digest}.json")
+
+def cached_keys(bucket_name, prefix, cache_dir='.cache', ttl=24 * 60 * 60):
+    """
+    Returns the cached key listing for prefix in the bucket, or None if there is
+    no listing younger than ttl seconds.
+    """
+    cache_file = _list_cache_file(bucket_name, prefix, cache_dir)
+    if os.path.exists(cache_file) and time.time() - os.path.getmtime(cache_file) < ttl:
+        with open(cache_file) as f:
+            return json.load(f)
+    return None
+
+def list_keys(bucket_name, prefix, cache_dir='.cache', ttl=24 * 60 * 60):
+    """
+    Lists all object keys with the given prefix in the bucket.
+    The listing is cached as JSON in cache_dir and reused for ttl seconds.
+    """
+    keys = cached_keys(bucket_name, prefix, cache_dir, ttl)
+    if keys is not None:
+        return keys
+
+    paginator = _S3.get_paginator('list_objects_v2')
+    pages = paginator.paginate(Bucket=bucket_name, Prefix=prefix, PaginationConfig={'PageSize': 1000})
+    keys = [obj['Key'] for page in pages for obj in page.get('Contents', [])]
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(_list_cache_file(bucket_name, prefix, cache_dir), 'w') as f:
+        json.dump(keys, f)
+    return keys
+
+def fetch_tile_files(bucket_name, tile_base, download_path, max_workers=DOWNLOAD_WORKERS):
+    """
+    Downloads the DEM GeoTIFFs of a tile that are missing in download_path.
+    Returns the local paths of all DEM files of the tile.
+    """
+    # Collect the DEM files and the ones still to download in one pass over the listing
+    local_tifs = []
+    downloads = []
+    for key in list_keys(bucket_name, tile_base):
+        if not key.endswith('DEM.tif'):
+            continue
+        local_file = f"{download_path}/{key.replace('/', '_')}"
+        local_tifs.append(local_file)
+        if os.path.exists(local_file):
+            print(f"File already exists, skipping: {local_file}")
+            continue
+        downloads.append((key, local_file))
+
+    # Download the missing files in parallel, the boto3 client is thread-safe
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_S3.download_file, bucket_name, key, local_file, Config=TRANSFER_CONFIG): (key, local_file)
+            for key, local_file in downloads
+        }
+        for future in as_completed(futures):
+            key, local_file = futures[future]
+            try:
+                future.result()
+                print(f"Downloaded {key} to {local_file}")
+            except Exception as e:
+                print(f"Error downloading {key}: {e}")
+    return local_tifs
+
+def download_tile_files(lat, lon, resolution=90, download_path='.', area_km=10, max_workers=DOWNLOAD_WORKERS):
     # Create the download_path folder if it does not exist
     if not os.path.exists(download_path):
         os.makedirs(download_path)
 
-    s3 = boto3.client('s3', config=Config(signature_version=UNSIGNED), region_name='eu-central-1')
     bucket_name = 'copernicus-dem-90m'
     tile_base = latlon_to_tile(lat, lon, resolution)
     print(f"Searching for files with base: {tile_base}")
 
-    # List all objects with Prefix
-    paginator = s3.get_paginator('list_objects_v2')
-    pages = paginator.paginate(Bucket=bucket_name, Prefix=tile_base)
-
-    found_files = []
-    for page in pages:
-        if 'Contents' in page:
-            for obj in page['Contents']:
-                found_files.append(obj['Key'])
+    local_tifs = sorted(glob.glob(f"{download_path}/{glob.escape(tile_base)}*DEM.tif"))
+    if cached_keys(bucket_name, tile_base) is not None:
+        # A cached listing tells exactly which files are missing, without calling S3
+        local_tifs = fetch_tile_files(bucket_name, tile_base, download_path, max_workers=max_workers)
+    elif local_tifs:
+        # Each Copernicus tile has a single DEM file, so any file on disk is
+        # taken as full coverage and neither a listing nor a download is needed
+        print(f"Files already exist, skipping S3: {', '.join(local_tifs)}")
+    else:
+        local_tifs = fetch_tile_files(bucket_name, tile_base, download_path, max_workers=max_workers)
 
-    if not found_files:
+    if not local_tifs:
         print("No files found for this tile.")
         return
 
-    for key in found_files:
-        if key.endswith('DEM.tif'):
-            local_file = f"{download_path}/{key.replace('/', '_')}"
-            if os.path.exists(local_file):
-                print(f"File already exists, skipping: {local_file}")
-                continue
-            try:
-                s3.download_file(bucket_name, key, local_file)
-                print(f"Downloaded {key} to {local_file}")
-            except Exception as e:
-                print(f"Error downloading {key}: {e}")
     # Convert the downloaded Elevation Difference GeoTIFF to STL
-    tif_files = [f for f in found_files if f.endswith('DEM.tif')]
-    for tif_file in tif_files:
-        local_tif_path = f"{download_path}/{tif_file.replace('/', '_')}"
+    for local_tif_path in local_tifs:
         stl_file = local_tif_path.replace('.tif', '.stl')
         print(f"Converting {local_tif_path} to {stl_file}")
         tif_to_stl(local_tif_path, stl_file, center_lat=lat, center_lon=lon, area_km=area_km, scale_z=1.0, sample_step=1, base_height=0.0, clip_min=None, clip_max=None)
 
 
-def normal_vector(triangle):
+# Binary STL facet record: normal, three vertices and the attribute byte count
+FACET_DTYPE = np.dtype([('n', '<f4', 3), ('a', '<f4', 3), ('b', '<f4', 3), ('c', '<f4', 3), ('attr', '<u2')])
+
+def pack_facets(n, a, b, c):
+    """
+    Packs normals and triangle corners, each of shape (len, 3), into binary STL facet records.
+    """
+    facets = np.zeros(len(a), dtype=FACET_DTYPE)
+    facets['n'] = n
+    facets['a'] = a
+    facets['b'] = b
+    facets['c'] = c
+    return facets
+
+# Smallest grid (rows * cols) worth the host/device transfers of the GPU path
+GPU_MIN_CELLS = 4_000_000
+
+def array_module(a):
     """
-    Calculate the normal vector of a triangle (3 points).
-    Returns a unit vector.
+    Returns cupy for arrays living on the GPU and numpy otherwise.
+    """
+    return cupy.get_array_module(a) if cupy is not None else np
+
+def normal_vectors(a, b, c):
     """
-    a, b, c = triangle
-    e1 = np.subtract(a, b).astype(np.float32)
-    e2 = np.subtract(b, c).astype(np.float32)
-    cp = np.cross(e1, e2)
-    mag = np.linalg.norm(cp)
-    if mag == 0:
-        return np.array([0.0, 0.0, 1.0], dtype=np.float32)
-    return cp / mag
-
-def tif_to_stl(tif_path, stl_path, center_lat, center_lon, area_km=10, scale_z=1.0, sample_step=1, base_height=0.0, clip_min=None, clip_max=None):
+    Calculate the normal vectors of many triangles at once.
+    a, b, c are arrays of shape (..., 3) holding the triangle corners.
+    Returns unit vectors of the same shape; degenerate triangles get (0, 0, 1).
+    """
+    xp = array_module(a)
+    e1 = xp.subtract(a, b, dtype=xp.float32)
+    e2 = xp.subtract(b, c, dtype=xp.float32)
+    # Cross product written out per component, cheaper than np.cross on large arrays
+    e1x, e1y, e1z = e1[..., 0], e1[..., 1], e1[..., 2]
+    e2x, e2y, e2z = e2[..., 0], e2[..., 1], e2[..., 2]
+    cp = xp.empty_like(e1)
+    cp[..., 0] = e1y * e2z - e1z * e2y
+    cp[..., 1] = e1z * e2x - e1x * e2z
+    cp[..., 2] = e1x * e2y - e1y * e2x
+    mag = xp.linalg.norm(cp, axis=-1, keepdims=True)
+    degenerate = mag[..., 0] == 0
+    mag[degenerate] = 1.0
+    cp /= mag
+    # Degenerate cross products are all zero, only z needs setting
+    cp[..., 2][degenerate] = 1.0
+    return cp
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _top_surface_facets(verts, quad_valid):
+        """
+        Build the two top surface triangles of every valid quad in the vertex grid.
+        Returns a float32 array of shape (n, 12) holding normal, a, b and c per facet,
+        in the same row-major order as the NumPy code path.
+        """
+        rows = verts.shape[0]
+        cols = verts.shape[1]
+        # Facet offset of each row, so rows can be filled in parallel
+        row_start = np.zeros(rows, dtype=np.int64)
+        for y in range(rows - 2):
+            row_start[y + 1] = row_start[y] + 2 * np.sum(quad_valid[y])
+        total = row_start[rows - 2] + 2 * np.sum(quad_valid[rows - 2]) if rows > 1 else 0
+        out = np.empty((total, 12), dtype=np.float32)
+        for y in prange(rows - 1):
+            i = row_start[y]
+            for x in range(cols - 1):
+                if not quad_valid[y, x]:
+                    continue
+                for t in range(2):
+                    if t == 0:
+                        a, b, c = verts[y, x], verts[y + 1, x], verts[y, x + 1]
+                    else:
+                        a, b, c = verts[y + 1, x + 1], verts[y, x + 1], verts[y + 1, x]
+                    e1x, e1y, e1z = a[0] - b[0], a[1] - b[1], a[2] - b[2]
+                    e2x, e2y, e2z = b[0] - c[0], b[1] - c[1], b[2] - c[2]
+                    nx = e1y * e2z - e1z * e2y
+                    ny = e1z * e2x - e1x * e2z
+                    nz = e1x * e2y - e1y * e2x
+                    mag = np.sqrt(nx * nx + ny * ny + nz * nz)
+                    if mag == 0:
+                        nx, ny, nz, mag = 0.0, 0.0, 1.0, 1.0
+                    out[i, 0] = nx / mag
+                    out[i, 1] = ny / mag
+                    out[i, 2] = nz / mag
+                    for k in range(3):
+                        out[i, 3 + k] = a[k]
+                        out[i, 6 + k] = b[k]
+                        out[i, 9 + k] = c[k]
+                    i += 1
+        return out
+else:
+    _top_surface_facets = None
+
+def tif_to_stl(tif_path, stl_path, center_lat, center_lon, area_km=10, scale_z=1.0, sample_step=1, base_height=0.0, clip_min=None, clip_max=None, dtype=None, use_gpu=False):
     """
     Converts a GeoTIFF terrain file to a 3D STL mesh with a solid base from zero height.
     Crops a square area of area_km x area_km around center_lat, center_lon.
+    Elevation is kept in the raster's own data type unless dtype is given, e.g. 'int16'
+    halves the elevation buffer of float32 tiles at a precision of whole meters.
+    The conversion happens after nodata cells are masked.
+    With use_gpu=True and cupy installed, large grids are meshed on the GPU.
     """
     with rasterio.open(tif_path) as src:
         transform = src.transform
@@ -108,16 +281,31 @@ def tif_to_stl(tif_path, stl_path, center_lat, center_lon, area_km=10, scale_z=1
             center_px - half_x, center_py - half_y, pixels_x, pixels_y
         )
 
-        elevation = src.read(1, window=window)[::sample_step, ::sample_step]
+        # Clip the window to the tile and let GDAL decimate while reading. Nearest
+        # sampling keeps real measured heights, so summits are not averaged down.
+        window = window.intersection(rasterio.windows.Window(0, 0, src.width, src.height))
+        out_shape = (max(1, int(window.height) // sample_step), max(1, int(window.width) // sample_step))
+        elevation = src.read(1, window=window, out_shape=out_shape, resampling=Resampling.nearest)
         nodata = src.nodata
-        elevation = np.nan_to_num(elevation)
+        # Mask of cells holding real elevation data
+        if nodata is None:
+            valid = np.ones(elevation.shape, dtype=bool)
+        elif np.isnan(nodata):
+            valid = ~np.isnan(elevation)
+        else:
+            valid = elevation != nodata
+        # Integer rasters cannot hold NaN, keep them in their compact native type
+        if np.issubdtype(elevation.dtype, np.floating):
+            np.nan_to_num(elevation, copy=False, nan=0.0)
+        # Convert only after masking and NaN removal, so nodata survives the cast
+        if dtype is not None:
+            elevation = elevation.astype(dtype, copy=False)
         rows, cols = elevation.shape
 
-    # Optionally clip elevation values
-    if clip_min is not None:
-        elevation[elevation < clip_min] = clip_min
-    if clip_max is not None:
-        elevation[elevation > clip_max] = clip_max
+    # Optionally clip elevation values in place, both bounds in one pass. Unsafe
+    # casting lets float or out-of-range bounds clip integer elevation like before.
+    if clip_min is not None or clip_max is not None:
+        np.clip(elevation, clip_min, clip_max, out=elevation, casting='unsafe')
 
     # Centering the grid
     x_offset = cols / 2
@@ -138,130 +326,104 @@ def tif_to_stl(tif_path, stl_path, center_lat, center_lon, area_km=10, scale_z=1
     print("Center Latitude:", center_lat, "Center Longitude:", center_lon)
     print("Base Height:", base_height)
 
-    vertices = []
-    for y in range(rows):
-        for x in range(cols):
-            z = elevation[y, x] * scale_z + base_height
-            vertices.append([x - x_offset, y_offset - y, z])
+    # Build the mesh on the GPU only for grids large enough to pay off
+    xp = np
+    if use_gpu and cupy is not None and rows * cols >= GPU_MIN_CELLS:
+        print("Assembling mesh on the GPU")
+        xp = cupy
+        elevation = cupy.asarray(elevation)
+        valid = cupy.asarray(valid)
+
+    # Vertex grid of shape (rows, cols, 3), indexed as verts[y, x]. The x and y
+    # coordinates are broadcast from one row/column instead of full meshgrid copies.
+    verts = xp.empty((rows, cols, 3), dtype=xp.float32)
+    verts[..., 0] = xp.arange(cols, dtype=xp.float32) - x_offset
+    verts[..., 1] = (y_offset - xp.arange(rows, dtype=xp.float32))[:, None]
+    # Scale the elevation straight into the float32 vertex grid, without a converted copy
+    xp.multiply(elevation, scale_z, out=verts[..., 2], dtype=xp.float32)
+    verts[..., 2] += base_height
 
     # Add base vertices (same x/y, z=0)
-    base_vertices = []
-    for y in range(rows):
-        for x in range(cols):
-            base_vertices.append([x - x_offset, y_offset - y, 0.0])
+    base_verts = verts.copy()
+    base_verts[..., 2] = 0.0
 
-    def write_stl(path, vertices, base_vertices, rows, cols):
+    def write_stl(path, verts, base_verts, rows, cols):
+        # Skip top surface quads that touch nodata cells
+        quad_valid = valid[:-1, :-1] & valid[1:, :-1] & valid[:-1, 1:] & valid[1:, 1:]
+        # Side strips
+        left_top1, left_top2 = verts[:-1, 0], verts[1:, 0]
+        left_base1, left_base2 = base_verts[:-1, 0], base_verts[1:, 0]
+        right_top1, right_top2 = verts[:-1, -1], verts[1:, -1]
+        right_base1, right_base2 = base_verts[:-1, -1], base_verts[1:, -1]
+        front_top1, front_top2 = verts[0, :-1], verts[0, 1:]
+        front_base1, front_base2 = base_verts[0, :-1], base_verts[0, 1:]
+        back_top1, back_top2 = verts[-1, :-1], verts[-1, 1:]
+        back_base1, back_base2 = base_verts[-1, :-1], base_verts[-1, 1:]
+        # Bottom face quad corners
+        ba, bb = base_verts[:-1, :-1], base_verts[1:, :-1]
+        bc, bd = base_verts[:-1, 1:], base_verts[1:, 1:]
+
+        # Each section holds two triangles per quad/strip segment, given as corner
+        # arrays (a, b, c), and the facet normal if it is the same for the whole section.
+        # Wall normals flip with the sign of the edge heights, so they are computed; the
+        # bottom lies flat at z=0, so its normal is constant.
+        sections = [
+            # Left side (x=0)
+            ((left_top1, left_base2, left_base1), (left_top1, left_top2, left_base2), None),
+            # Right side (x=cols-1)
+            ((right_top1, right_base1, right_base2), (right_top1, right_base2, right_top2), None),
+            # Front side (y=0)
+            ((front_top1, front_base1, front_base2), (front_top1, front_base2, front_top2), None),
+            # Back side (y=rows-1)
+            ((back_top1, back_base2, back_base1), (back_top1, back_top2, back_base2), None),
+            # Bottom face
+            ((ba, bb, bc), (bd, bc, bb), (0.0, 0.0, 1.0)),
+        ]
         # Top surface facets
-        facet_count = (rows - 1) * (cols - 1) * 2
+        facet_count = int(quad_valid.sum()) * 2
         # Add side and bottom facets
         facet_count += (rows - 1) * 2 * 2  # left/right sides
         facet_count += (cols - 1) * 2 * 2  # front/back sides
         facet_count += (rows - 1) * (cols - 1) * 2  # bottom
 
-        with open(path, 'wb') as f:
+        def section(n, a, b, c):
+            # Facet records of one section; on the GPU a plain (len, 12) float32 buffer
+            if xp is np:
+                return pack_facets(n, a, b, c)
+            return xp.concatenate([xp.broadcast_to(n, a.shape), a, b, c], axis=1)
+
+        # Top surface
+        blocks = []
+        if _top_surface_facets is not None and xp is np:
+            top = _top_surface_facets(verts, quad_valid)
+            blocks.append(section(top[:, 0:3], top[:, 3:6], top[:, 6:9], top[:, 9:12]))
+        else:
+            qa, qb = verts[:-1, :-1][quad_valid], verts[1:, :-1][quad_valid]
+            qc, qd = verts[:-1, 1:][quad_valid], verts[1:, 1:][quad_valid]
+            sections = [((qa, qb, qc), (qd, qc, qb), None)] + sections
+
+        for (a1, b1, c1), (a2, b2, c2), normal in sections:
+            # Interleave the two triangles of each quad/strip segment
+            a = xp.stack([a1, a2], axis=-2).reshape(-1, 3)
+            b = xp.stack([b1, b2], axis=-2).reshape(-1, 3)
+            c = xp.stack([c1, c2], axis=-2).reshape(-1, 3)
+            n = normal_vectors(a, b, c) if normal is None else xp.asarray(normal, dtype=xp.float32)
+            blocks.append(section(n, a, b, c))
+
+        facets = xp.concatenate(blocks)
+        if xp is not np:
+            # Copy the assembled facets back from the device in one transfer
+            host = cupy.asnumpy(facets)
+            facets = pack_facets(host[:, 0:3], host[:, 3:6], host[:, 6:9], host[:, 9:12])
+        assert len(facets) == facet_count
+
+        # Write straight from the facet array's buffer, without a bytes copy
+        with open(path, 'wb', buffering=8 * 1024 * 1024) as f:
             f.write(b'\0' * 80)
             f.write(np.array([facet_count], dtype='<u4').tobytes())
-            # Top surface
-            for y in range(rows - 1):
-                for x in range(cols - 1):
-                    i = y * cols + x
-                    a = i
-                    b = i + cols
-                    c = i + 1
-                    d = b + 1
-                    av = elevation[y, x]
-                    bv = elevation[y + 1, x]
-                    cv = elevation[y, x + 1]
-                    dv = elevation[y + 1, x + 1]
-                    if nodata is not None and (av == nodata or bv == nodata or cv == nodata or dv == nodata):
-                        continue
-                    tri1 = (vertices[a], vertices[b], vertices[c])
-                    n1 = normal_vector(tri1)
-                    f.write(np.array(n1, dtype='<f4').tobytes())
-                    for v in tri1:
-                        f.write(np.array(v, dtype='<f4').tobytes())
-                    f.write(b'\0\0')
-                    tri2 = (vertices[d], vertices[c], vertices[b])
-                    n2 = normal_vector(tri2)
-                    f.write(np.array(n2, dtype='<f4').tobytes())
-                    for v in tri2:
-                        f.write(np.array(v, dtype='<f4').tobytes())
-                    f.write(b'\0\0')
-            # Sides
-            # Left side (x=0)
-            for y in range(rows - 1):
-                top1 = y * cols
-                top2 = (y + 1) * cols
-                base1 = y * cols
-                base2 = (y + 1) * cols
-                tri1 = (vertices[top1], base_vertices[base2], base_vertices[base1])
-                tri2 = (vertices[top1], vertices[top2], base_vertices[base2])
-                for tri in [tri1, tri2]:
-                    n = normal_vector(tri)
-                    f.write(np.array(n, dtype='<f4').tobytes())
-                    for v in tri:
-                        f.write(np.array(v, dtype='<f4').tobytes())
-                    f.write(b'\0\0')
-            # Right side (x=cols-1)
-            for y in range(rows - 1):
-                top1 = y * cols + (cols - 1)
-                top2 = (y + 1) * cols + (cols - 1)
-                base1 = y * cols + (cols - 1)
-                base2 = (y + 1) * cols + (cols - 1)
-                tri1 = (vertices[top1], base_vertices[base1], base_vertices[base2])
-                tri2 = (vertices[top1], base_vertices[base2], vertices[top2])
-                for tri in [tri1, tri2]:
-                    n = normal_vector(tri)
-                    f.write(np.array(n, dtype='<f4').tobytes())
-                    for v in tri:
-                        f.write(np.array(v, dtype='<f4').tobytes())
-                    f.write(b'\0\0')
-            # Front side (y=0)
-            for x in range(cols - 1):
-                top1 = x
-                top2 = x + 1
-                base1 = x
-                base2 = x + 1
-                tri1 = (vertices[top1], base_vertices[base1], base_vertices[base2])
-                tri2 = (vertices[top1], base_vertices[base2], vertices[top2])
-                for tri in [tri1, tri2]:
-                    n = normal_vector(tri)
-                    f.write(np.array(n, dtype='<f4').tobytes())
-                    for v in tri:
-                        f.write(np.array(v, dtype='<f4').tobytes())
-                    f.write(b'\0\0')
-            # Back side (y=rows-1)
-            for x in range(cols - 1):
-                top1 = (rows - 1) * cols + x
-                top2 = (rows - 1) * cols + x + 1
-                base1 = (rows - 1) * cols + x
-                base2 = (rows - 1) * cols + x + 1
-                tri1 = (vertices[top1], base_vertices[base2], base_vertices[base1])
-                tri2 = (vertices[top1], vertices[top2], base_vertices[base2])
-                for tri in [tri1, tri2]:
-                    n = normal_vector(tri)
-                    f.write(np.array(n, dtype='<f4').tobytes())
-                    for v in tri:
-                        f.write(np.array(v, dtype='<f4').tobytes())
-                    f.write(b'\0\0')
-            # Bottom face
-            for y in range(rows - 1):
-                for x in range(cols - 1):
-                    i = y * cols + x
-                    a = i
-                    b = i + cols
-                    c = i + 1
-                    d = b + 1
-                    tri1 = (base_vertices[a], base_vertices[b], base_vertices[c])
-                    tri2 = (base_vertices[d], base_vertices[c], base_vertices[b])
-                    for tri in [tri1, tri2]:
-                        n = normal_vector(tri)
-                        f.write(np.array(n, dtype='<f4').tobytes())
-                        for v in tri:
-                            f.write(np.array(v, dtype='<f4').tobytes())
-                        f.write(b'\0\0')
-
-    write_stl(stl_path, vertices, base_vertices, rows, cols)
+            f.write(memoryview(facets).cast('B'))
+
+    write_stl(stl_path, verts, base_verts, rows, cols)
     print(f"✅ Solid STL file saved: {stl_path}")
 
 if __name__ == "__main__":
@@ -2,9 +2,12 @@ import boto3
 from botocore import UNSIGNED
 from botocore.config import Config
 
+# Anonymous S3 client created once and reused by every listing call
+_SESSION = boto3.session.Session()
+_S3 = _SESSION.client('s3', config=Config(signature_version=UNSIGNED), region_name='eu-central-1')
+
 def list_all_files(bucket_name):
-    s3 = boto3.client('s3', config=Config(signature_version=UNSIGNED), region_name='eu-central-1')
-    paginator = s3.get_paginator('list_objects_v2')
+    paginator = _S3.get_paginator('list_objects_v2')
     pages = paginator.paginate(Bucket=bucket_name)
 
     all_files = []